@@ -7,6 +7,7 @@ from pathlib import Path
 from typing import Dict, Tuple
 
 import click
+import numpy as np
 import pandas as pd
 from pyproj import Proj
 
@@ -223,10 +224,7 @@ def normaliser_lokationskoordinat(
     output: UTM-koordinater i traditionel lokationskoordinatorden)
     er indtil videre kun understøttet for `region=="DK"`.
     """
-    global utm32
-    if utm32 is None:
-        utm32 = Proj("proj=utm zone=32 ellps=GRS80", preserve_units=False)
-        assert utm32 is not None, "Kan ikke initialisere projektionselelement utm32"
+    initialiser_utm32()
 
     # Begrænset understøttelse af FO, GL, hvor UTM32 er meningsløst.
     # Der er gjort plads til indførelse af UTM24 og UTM29 hvis der skulle
@@ -259,6 +257,34 @@ def normaliser_lokationskoordinat(
 # Globalt transformationsobjekt til normaliser_lokationskoordinat
 utm32 = None
 
+
+# ------------------------------------------------------------------------------
+def initialiser_utm32() -> None:
+    """Opret det globale transformationsobjekt utm32, hvis det ikke findes"""
+    global utm32
+    if utm32 is None:
+        utm32 = Proj("proj=utm zone=32 ellps=GRS80", preserve_units=False)
+        assert utm32 is not None, "Kan ikke initialisere projektionselelement utm32"
+
+
+# ------------------------------------------------------------------------------
+def lokationskoordinater_til_utm(
+    λ: np.ndarray, φ: np.ndarray, region: str = "DK"
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Omregn arrays af geografiske lokationskoordinater til UTM.
+
+    Svarer til `normaliser_lokationskoordinat(λ, φ, region, invers=True)`
+    anvendt på hvert element, men klarer omregningen med et enkelt kald
+    til pyproj.
+    """
+    initialiser_utm32()
+
+    if region not in ("DK", ""):
+        return (λ, φ)
+
+    return utm32(λ, φ, inverse=False)
+
+
 # -----------------------------------------------------------------------------
 def skriv_ark(
     projektnavn: str, nye_faneblade: Dict[str, pd.DataFrame], suffix: str = ""
@@ -1,25 +1,78 @@
 import re
 import sys
-from typing import Tuple
+from collections import namedtuple
+from operator import attrgetter, itemgetter
+from typing import List, Tuple
 
 import click
+import numpy as np
 import pandas as pd
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, selectinload
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.sql import text
+from sqlalchemy.sql import bindparam, text
 
 import fire.cli
-from fire.api.model import Punkt
+from fire.api.model import Punkt, PunktInformation
 
 from . import (
     ARKDEF_REVISION,
     niv,
-    normaliser_lokationskoordinat,
+    lokationskoordinater_til_utm,
     skriv_ark,
     find_sag,
 )
 
 
+# Punkter med bare EN af disse attributter ignoreres
+UØNSKEDE_PUNKTER = frozenset(
+    {
+        "ATTR:hjælpepunkt",
+        "ATTR:tabtgået",
+        "ATTR:teknikpunkt",
+        "AFM:naturlig",
+        "ATTR:MV_punkt",
+    }
+)
+
+# Disse attributter indgår ikke i punktrevisionen
+# (men det diskvalificerer ikke et punkt at have dem)
+IGNOREREDE_ATTRIBUTTER = frozenset(
+    {
+        "REGION:DK",
+        "IDENT:refgeo_id",
+        "IDENT:station",
+        "NET:10KM",
+        "SKITSE:master_md5",
+        "SKITSE:master_sti",
+        "SKITSE:png_md5",
+        "SKITSE:png_sti",
+        "ATTR:fundamentalpunkt",
+        "ATTR:tinglysningsnr",
+    }
+)
+
+# Attributter der vises øverst i revisionsarket, i den anførte rækkefølge
+VISNINGSPRIORITET = {
+    "ATTR:muligt_datumstabil": 0,
+    "ATTR:beskrivelse": 1,
+}
+
+# Række i revisionsarket. Felterne svarer til søjlerne i ARKDEF_REVISION,
+# og felter der ikke angives står tomme
+Revisionsrække = namedtuple(
+    "Revisionsrække",
+    [navn.lower().replace(" ", "_") for navn in ARKDEF_REVISION],
+    defaults=len(ARKDEF_REVISION) * (None,),
+)
+
+# Oracle tillader højst 1000 elementer i en IN-liste, så lange lister
+# deles op i bidder af denne størrelse
+IN_LISTE_BIDSTØRRELSE = 500
+
+# Opmålingsdistrikter angives som fx "K-63" eller "102-08"
+DISTRIKTSMØNSTER = re.compile(r"^(\d{1,3}|[kK])-\d{2}$")
+
+
 @niv.command()
 @fire.cli.default_options()
 @click.argument(
@@ -35,169 +88,196 @@ def udtræk_revision(projektnavn: str, kriterier: Tuple[str], **kwargs) -> None:
     """
     # Kontroller at projektet er oprettet etc.
     find_sag(projektnavn)
-    revision = pd.DataFrame(columns=tuple(ARKDEF_REVISION)).astype(ARKDEF_REVISION)
 
-    # Punkter med bare EN af disse attributter ignoreres
-    uønskede_punkter = [
-        "ATTR:hjælpepunkt",
-        "ATTR:tabtgået",
-        "ATTR:teknikpunkt",
-        "AFM:naturlig",
-        "ATTR:MV_punkt",
-    ]
+    # Rækkerne opsamles i en liste, og regnearket opbygges først til sidst:
+    # DataFrame.append kopierer hele rammen ved hvert kald
+    rækker = []
 
-    # Disse attributter indgår ikke i punktrevisionen
-    # (men det diskvalificerer ikke et punkt at have dem)
-    ignorerede_attributter = [
-        "REGION:DK",
-        "IDENT:refgeo_id",
-        "IDENT:station",
-        "NET:10KM",
-        "SKITSE:master_md5",
-        "SKITSE:master_sti",
-        "SKITSE:png_md5",
-        "SKITSE:png_sti",
-        "ATTR:fundamentalpunkt",
-        "ATTR:tinglysningsnr",
-    ]
+    # Punktinformationer og geometri hentes for alle punkter på én gang,
+    # i stedet for ved ét opslag pr. punkt i løkken nedenfor
+    indlæsning = (
+        selectinload(Punkt.punktinformationer).joinedload(PunktInformation.infotype),
+        selectinload(Punkt.geometriobjekter),
+    )
 
     opmålingsdistrikter = []
     løse_punkter = []
     punkter = []
     for kriterie in kriterier:
-        if re.match(r"^(\d{1,3}|[kK])-\d{2}$", kriterie):
+        if DISTRIKTSMØNSTER.match(kriterie):
             opmålingsdistrikter.append(kriterie)
         else:
             løse_punkter.append(kriterie)
 
     if opmålingsdistrikter:
-        distrikter = ",".join([f"'{d.upper()}'" for d in opmålingsdistrikter])
-        uønsket = ",".join([f"'{p}'" for p in uønskede_punkter])
-        pkt_i_distrikter = f"""
+        # Distrikter og infotyper indsættes som bindeparametre, så SQL-teksten
+        # er den samme fra gang til gang og kan genbruges af SQLAlchemy og Oracle
+        #
+        # Herredsognkoderne er lagret med store bogstaver (se data/herredsogn.shp),
+        # så distrikterne omsættes til store bogstaver inden de indsættes. Dermed
+        # kan hs.kode sammenlignes direkte, uden upper() på hver række.
+        pkt_i_distrikter = """
                     SELECT p.*
                     FROM (
                         SELECT DISTINCT g.punktid FROM geometriobjekt g
                         JOIN herredsogn hs
                         ON sdo_inside(g.geometri, hs.geometri) = 'TRUE'
                         WHERE
-                            upper(hs.kode) IN ({distrikter})
+                            hs.kode IN :distrikter
                         AND
                             g.registreringtil IS NULL
                     ) a
                     LEFT JOIN (
                         SELECT DISTINCT pi.punktid FROM punktinfo pi
                         JOIN punktinfotype pit ON pit.infotypeid=pi.infotypeid
-                        WHERE pit.infotype IN ({uønsket}) AND pi.registreringtil IS NULL
+                        WHERE pit.infotype IN :infotyper AND pi.registreringtil IS NULL
                     ) b
                     ON a.punktid = b.punktid
                     JOIN punkt p ON p.id = a.punktid
-                    WHERE b.punktid IS NULL AND p.registreringtil IS NULL
-                    ORDER BY p.registreringfra"""
+                    WHERE b.punktid IS NULL AND p.registreringtil IS NULL"""
 
-        stmt = text(pkt_i_distrikter).columns(Punkt.objektid)
-        punkter.extend(fire.cli.firedb.session.query(Punkt).from_statement(stmt).all())
-
-    try:
+        stmt = (
+            text(pkt_i_distrikter)
+            .bindparams(
+                bindparam("distrikter", expanding=True),
+                bindparam("infotyper", expanding=True),
+            )
+            .columns(Punkt.objektid)
+        )
         punkter.extend(
-            fire.cli.firedb.hent_punkt_liste(løse_punkter, ignorer_ukendte=False)
+            fire.cli.firedb.session.query(Punkt)
+            .from_statement(stmt)
+            .options(*indlæsning)
+            .params(
+                distrikter=[d.upper() for d in opmålingsdistrikter],
+                infotyper=sorted(UØNSKEDE_PUNKTER),
+            )
+            .all()
         )
+
+    try:
+        fundne = fire.cli.firedb.hent_punkt_liste(løse_punkter, ignorer_ukendte=False)
     except ValueError as ex:
         fire.cli.print(f"FEJL: {ex}", bg="red", fg="white")
         sys.exit(1)
 
-    for punkt in sorted(punkter):
-        datumstabilt = False
-        ident = punkt.landsnummer
-        fire.cli.print(f"Punkt: {ident}")
-
-        # Angiv ident og lokationskoordinat
-        try:
-            lokation = punkt.geometri.koordinater
-        except AttributeError:
-            fire.cli.print(
-                f"NB! {ident} mangler lokationskoordinat - bruger (11,56)",
-                fg="yellow",
-                bold=True,
-            )
-            lokation = (11.0, 56.0)
-
-        lokation = normaliser_lokationskoordinat(lokation[0], lokation[1], "DK", True)
-        revision = revision.append(
-            {
-                "Punkt": ident,
-                "Attribut": "LOKATION",
-                # Centimeterafrunding for lokationskoordinaten er rigeligt
-                "Tekstværdi": f"{lokation[1]:.3f} m   {lokation[0]:.3f} m",
-                "Ikke besøgt": "x",
-            },
-            ignore_index=True,
+    fundne_ider = [punkt.id for punkt in fundne]
+    for i in range(0, len(fundne_ider), IN_LISTE_BIDSTØRRELSE):
+        punkter.extend(
+            fire.cli.firedb.session.query(Punkt)
+            .options(*indlæsning)
+            .filter(Punkt.id.in_(fundne_ider[i : i + IN_LISTE_BIDSTØRRELSE]))
+            .all()
         )
 
-        # Find index for aktuelle datumstabilitetsstatus,
-        # for at kunne vise den først
-        indices = list(range(len(punkt.punktinformationer)))
-        for i, info in enumerate(punkt.punktinformationer):
-            if info.registreringtil is not None:
-                continue
-            if info.infotype.name != "ATTR:muligt_datumstabil":
-                continue
-            datumstabilt = True
-            indices[0], indices[i] = indices[i], indices[0]
-            break
-        else:
-            revision = revision.append(
-                {
-                    "Attribut": "ATTR:muligt_datumstabil",
-                    "Sluk": "x",
-                },
-                ignore_index=True,
-            )
+    # Et løst punkt kan også ligge i et af de udtrukne distrikter
+    punkter = list({punkt.id: punkt for punkt in punkter}.values())
 
-        # Find index for aktuelle punktbeskrivelse, for at kunne vise den øverst
-        for i, info in enumerate(punkt.punktinformationer):
-            if info.registreringtil is not None:
-                continue
-            if info.infotype.name != "ATTR:beskrivelse":
-                continue
-
-            # ATTR:beskrivelse's placering i listen afhænger af om der findes
-            # et ATTR:muligt_datumstabil i databasen eller ej
-            pos = 1 if datumstabilt else 0
-            indices[pos], indices[i] = indices[i], indices[pos]
-            break
-
-        # Så itererer vi, med aktuelle beskrivelse først
-        for i in indices:
-            info = punkt.punktinformationer[i]
-            if info.registreringtil is not None:
-                continue
-
-            attributnavn = info.infotype.name
-            if attributnavn in ignorerede_attributter:
-                continue
-
-            # Vis kun landsnr for punkter med GM/GI/GNSS-primærident
-            if attributnavn == "IDENT:landsnr" and info.tekst == ident:
-                continue
-
-            tekst = info.tekst
-            if tekst:
-                tekst = tekst.strip()
-            tal = info.tal
-            revision = revision.append(
-                {
-                    "Sluk": "",
-                    "Attribut": attributnavn,
-                    "Talværdi": tal,
-                    "Tekstværdi": tekst,
-                    "id": info.objektid,
-                },
-                ignore_index=True,
-            )
+    # Landsnummeret afledes af punktinformationerne, så det kan ikke bruges
+    # til sortering i databasen. Som sorteringsnøgle slås det kun op én gang
+    # pr. punkt, i stedet for ved hver sammenligning
+    punkter.sort(key=attrgetter("landsnummer"))
+
+    # Lokationskoordinaterne omregnes samlet for alle punkter. Punkter uden
+    # lokationskoordinat placeres i (11,56), og der advares om dem nedenfor
+    geometrier = [punkt.geometri for punkt in punkter]
+    lokationer = np.array(
+        [
+            geometri.koordinater if geometri is not None else (11.0, 56.0)
+            for geometri in geometrier
+        ],
+        dtype=np.float64,
+    ).reshape(-1, 2)
+    øst, nord = lokationskoordinater_til_utm(lokationer[:, 0], lokationer[:, 1], "DK")
 
-        # Fem blanklinjer efter hvert punktoversigt
-        revision = revision.append(5 * [{}], ignore_index=True)
+    # Udskrift pr. punkt bliver hurtigt dominerende for store udtræk, så
+    # vi nøjes med en samlet status før og efter løkken
+    fire.cli.print(f"Udtrækker {len(punkter)} punkter")
+    uden_lokation = []
+
+    for punkt, geometri, lokation in zip(punkter, geometrier, zip(øst, nord)):
+        ident = punkt.landsnummer
+        if geometri is None:
+            uden_lokation.append(ident)
+        rækker.extend(punktrækker(ident, lokation, punkt.punktinformationer))
+
+    if uden_lokation:
+        fire.cli.print(
+            f"NB! Disse punkter mangler lokationskoordinat - bruger (11,56): "
+            f"{', '.join(uden_lokation)}",
+            fg="yellow",
+            bold=True,
+        )
+
+    # Søjlerne oprettes direkte med den rette type. Rækkerne frigives inden
+    # regnearket skrives, så de ikke ligger i hukommelsen i to udgaver imens
+    søjler = zip(*rækker) if rækker else len(ARKDEF_REVISION) * [()]
+    revision = pd.DataFrame(
+        {
+            navn: pd.Series(søjle, dtype=object if søjletype is str else søjletype)
+            for (navn, søjletype), søjle in zip(ARKDEF_REVISION.items(), søjler)
+        }
+    )
+    del rækker, søjler
 
     resultater = {"Revision": revision}
     skriv_ark(projektnavn, resultater, "-revision")
     fire.cli.print("Færdig!")
+
+
+def punktrækker(
+    ident: str, lokation: Tuple[float, float], informationer: List
+) -> List[Revisionsrække]:
+    """Revisionsarkets rækker for et enkelt punkt.
+
+    `lokation` er den normaliserede lokationskoordinat, og `informationer`
+    er punktets punktinformationer i registreringsrækkefølge. Afregistrerede
+    punktinformationer og ignorerede attributter springes over.
+    """
+    rækker = [
+        Revisionsrække(
+            punkt=ident,
+            attribut="LOKATION",
+            # Centimeterafrunding for lokationskoordinaten er rigeligt
+            tekstværdi=f"{lokation[1]:.3f} m   {lokation[0]:.3f} m",
+            ikke_besøgt="x",
+        )
+    ]
+
+    # Aktuelle datumstabilitetsstatus og punktbeskrivelse vises øverst,
+    # resten i den rækkefølge de er registreret
+    aktive = []
+    for i, info in enumerate(informationer):
+        if info.registreringtil is not None:
+            continue
+        attributnavn = info.infotype.name
+        if attributnavn in IGNOREREDE_ATTRIBUTTER:
+            continue
+        prioritet = VISNINGSPRIORITET.get(attributnavn, len(VISNINGSPRIORITET))
+        aktive.append((prioritet, i, attributnavn, info))
+    aktive.sort(key=itemgetter(0, 1))
+
+    if not aktive or aktive[0][2] != "ATTR:muligt_datumstabil":
+        rækker.append(Revisionsrække(attribut="ATTR:muligt_datumstabil", sluk="x"))
+
+    for _, _, attributnavn, info in aktive:
+        # Vis kun landsnr for punkter med GM/GI/GNSS-primærident
+        if attributnavn == "IDENT:landsnr" and info.tekst == ident:
+            continue
+
+        tekst = info.tekst
+        if tekst:
+            tekst = tekst.strip()
+        rækker.append(
+            Revisionsrække(
+                sluk="",
+                attribut=attributnavn,
+                talværdi=info.tal,
+                tekstværdi=tekst,
+                id=info.objektid,
+            )
+        )
+
+    # Fem blanklinjer efter hvert punktoversigt
+    rækker.extend(5 * [Revisionsrække()])
+    return rækker
@@ -3,6 +3,7 @@ import os
 from pathlib import Path
 
 import click
+import numpy as np
 import pytest
 
 from click.testing import CliRunner
@@ -11,8 +12,11 @@ from fire.cli.niv import (
     niv,
     find_faneblad,
     skriv_ark,
+    normaliser_lokationskoordinat,
+    lokationskoordinater_til_utm,
     ARKDEF_NYETABLEREDE_PUNKTER,
     ARKDEF_FILOVERSIGT,
+    ARKDEF_REVISION,
 )
 
 
@@ -28,10 +32,29 @@ def test_revision(mocker):
         assert result.exit_code == 0
 
         # fire niv udtræk-revision test
-        result = runner.invoke(niv, ["udtræk-revision", "testsag", "k-63", "SKEJ"])
+        # RDIO (K-63-00909) ligger i K-63 og angives også eksplicit
+        result = runner.invoke(
+            niv, ["udtræk-revision", "testsag", "k-63", "SKEJ", "RDIO"]
+        )
         print(result.output)
         assert result.exit_code == 0
 
+        revision = find_faneblad("testsag-revision", "Revision", ARKDEF_REVISION)
+        attributter = list(revision["Attribut"])
+        lokationer = [i for i, a in enumerate(attributter) if a == "LOKATION"]
+        punkter = list(revision["Punkt"].iloc[lokationer])
+
+        # Hvert punkt optræder kun én gang, og punkterne er sorteret efter landsnummer
+        assert punkter.count("K-63-00909") == 1
+        assert punkter == sorted(punkter)
+
+        # Hver punktblok indledes med lokation, datumstabilitet og beskrivelse
+        for start, slut in zip(lokationer, lokationer[1:] + [len(attributter)]):
+            blok = attributter[start:slut]
+            assert blok[:2] == ["LOKATION", "ATTR:muligt_datumstabil"]
+            if "ATTR:beskrivelse" in blok:
+                assert blok[2] == "ATTR:beskrivelse"
+
         # fire niv ilæg-revision test
         mocker.patch("fire.cli.niv._ilæg_revision.bekræft", return_value=True)
         result = runner.invoke(niv, ["ilæg-revision", "testsag"])
@@ -115,3 +138,16 @@ def test_observationer(mocker):
         result = runner.invoke(niv, ["luk-sag", "testsag"])
         print(result.output)
         assert result.exit_code == 0
+
+
+def test_lokationskoordinater_til_utm():
+    """Samlet omregning skal give samme resultat som punktvis"""
+    λ = np.array([10.2, 8.5, 12.6, 15.1])
+    φ = np.array([56.1, 55.0, 55.7, 55.1])
+
+    for region in ("DK", "GL"):
+        øst, nord = lokationskoordinater_til_utm(λ, φ, region)
+        for i in range(len(λ)):
+            forventet = normaliser_lokationskoordinat(λ[i], φ[i], region, True)
+            assert øst[i] == pytest.approx(forventet[0])
+            assert nord[i] == pytest.approx(forventet[1])